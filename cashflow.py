@@ -1,21 +1,23 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from dateutil.relativedelta import relativedelta
 import timeutils
+from dataloader import portfolio_to_soa, asset_to_soa, market_groups
 from yieldcurve import YieldCurve
 
 
-def amortization_schedule(rate=0, maturity=1, volume=1, payment_type='BULLET'):
-    """ Returns the amortization schedule of the loan """
-    if isinstance(rate, (float, int)):
-        rate = np.full(maturity, rate)
-    
+PAYMENT_TYPES = ('BULLET', 'LINEAR', 'ANNUITY')
+
+
+def _amortization_arrays(rate, maturity, volume, payment_type):
+    """ Returns the cashflow, interest, capital and remaining balance arrays of the loan """
     if payment_type == 'BULLET':
-        interest = rate * volume
+        # Interest is paid on the full volume, rate can be a scalar or one rate per period
+        interest = np.empty(maturity)
+        interest[:] = rate * volume
         capital = np.zeros(maturity)
         capital[-1] = volume
-        remaining = np.full(maturity, volume)-capital
+        remaining = volume - capital
         cashflow = capital + interest
     elif payment_type == 'LINEAR':
         # Calculate capital
@@ -26,84 +28,158 @@ def amortization_schedule(rate=0, maturity=1, volume=1, payment_type='BULLET'):
         interest = remaining[:maturity] * rate
         # Calculate total cash flow for each period
         cashflow = capital + interest
-    elif payment_type == 'ANNUITY':
-        interest = np.zeros(maturity)
-        capital = np.zeros(maturity)
-        cashflow = np.zeros(maturity)
-        remaining = [volume]
-        for i in range(maturity):
-            discount_factor = 1 - (1 + rate[i]) ** (-(maturity - i + 1))
-            cashflow[i] = (rate[i] / discount_factor) * remaining[i] if rate[i] != 0 else remaining[i] / (maturity - i + 1)
-            interest[i] = remaining[i] * rate[i]
-            capital[i] = cashflow[i] - interest[i]
-            remaining.append(remaining[i]-capital[i])
-        remaining = remaining[1:]
     else:
+        # Number of periods left at each payment
+        periods = np.arange(maturity + 1, 1, -1)
+        # Share of the outstanding balance paid at each period
+        with np.errstate(divide='ignore', invalid='ignore'):
+            payment_share = np.where(rate != 0, rate / (1 - (1 + rate) ** (-periods)), 1 / periods)
+        # The balance shrinks by a factor of (1 + rate - payment_share) each period
+        remaining = volume * np.cumprod(1 + rate - payment_share)
+        outstanding = np.concatenate(([volume], remaining[:-1]))
+        # Calculate cash flow, interest and capital on the outstanding balance
+        cashflow = payment_share * outstanding
+        interest = outstanding * rate
+        capital = cashflow - interest
+
+    return cashflow, interest, capital, remaining
+
+
+def amortization_schedule(rate=0, maturity=1, volume=1, payment_type='BULLET'):
+    """ Returns the amortization schedule of the loan """
+    if payment_type not in PAYMENT_TYPES:
         raise TypeError("payment_type can be either BULLET, LINEAR or ANNUITY")
-    
+    # A scalar rate is broadcast by the amortization arithmetic
+    if np.ndim(rate) == 0:
+        rate = float(rate)
+    else:
+        rate = np.asarray(rate, dtype=float)
+
+    cashflow, interest, capital, remaining = _amortization_arrays(rate, maturity, volume, payment_type)
     cf_df = pd.DataFrame({'cashflow': cashflow, 'interest': interest, 'capital': capital, 'remaining': remaining})
     return cf_df
 
 
-def asset_cashflow(portfolio, market, id, today):
-    """ Gets cashflow for asset in portfolio with id, given the market """
+def _asset_dates(portfolio, i, today):
+    """ Returns the payment dates and the future repricing dates of the asset at position i """
+    today_date = np.datetime64(today, 'D')
     # CALCULATE PAYMENT PERIODS
-    maturity_date = portfolio['maturity'][id].to_pydatetime()
-    payment_periods = timeutils.date_range(start=maturity_date, end=today, step=1)
-    payment_periods = [date for date in payment_periods if date > today]
+    maturity_date = portfolio.maturity[i]
+    payment_periods = timeutils.month_range(start=maturity_date, end=today_date, step=1)
+    payment_periods = payment_periods[payment_periods > today_date]
     # DETERMINE PAYMENT FREQUENCY
-    payment_freq = portfolio['payment_freq'][id]
+    payment_freq = portfolio.payment_freq[i]
     # SELECT PAYMENT DATES
-    payment_dates = payment_periods[::payment_freq]
-    payment_dates = payment_dates[::-1]
-    # CALCULATE INTEREST RATES
-    ir_binding = portfolio['ir_binding'][id]
-    spread = portfolio['spread'][id]
-    if ir_binding == 'FIX':
-        rate = spread
-    else:
-        # CALCULATE REPRICING PERIODS
-        issue_date = portfolio['issue'][id].to_pydatetime()
-        reprice_periods = timeutils.date_range(start=issue_date, end=maturity_date, step=1)
-        # DETERMINE REPRICING FREQUENCY
-        reprice_freq = portfolio['reprice_freq'][id]
-        # SELECT REPRICING DATES
-        reprice_dates = reprice_periods[::int(reprice_freq)]
-        reprice_dates = [date for date in reprice_dates if date > today]
-        
-        if len(reprice_dates) > 0:
-            # CALCULATE FLOATING YIELDS
-            yieldcurve_type = portfolio['yieldcurve'][id]
+    payment_dates = payment_periods[::payment_freq][::-1]
+    if portfolio.ir_binding_is_fix[i]:
+        return payment_dates, np.empty(0, dtype='datetime64[D]')
+    # CALCULATE REPRICING PERIODS
+    reprice_periods = timeutils.month_range(start=portfolio.issue[i], end=maturity_date, step=1)
+    # DETERMINE REPRICING FREQUENCY
+    reprice_freq = portfolio.reprice_freq[i]
+    # SELECT REPRICING DATES
+    reprice_dates = reprice_periods[::reprice_freq]
+    reprice_dates = reprice_dates[reprice_dates > today_date]
+    return payment_dates, reprice_dates
+
+
+def _period_rates(portfolio, positions, dates, market, today, curve_cache):
+    """ 
+    Returns the rate per payment period of the assets at positions, given their
+    payment and repricing dates. The floating yields of all assets on the same
+    yield curve are calculated in a single batched call
+    """
+    # FIX ASSETS AND FLOATING ASSETS WITHOUT FUTURE REPRICING PAY THE SPREAD
+    rates = [portfolio.spread[i] for i in positions]
+    floating = [k for k, (_, reprice_dates) in enumerate(dates) if len(reprice_dates) > 0]
+    codes = np.array([portfolio.yieldcurve_code[positions[k]] for k in floating], dtype=np.int64)
+    for code in np.unique(codes):
+        assets = [k for k, asset_code in zip(floating, codes) if asset_code == code]
+        # GET OR FIT THE YIELD CURVE
+        yieldcurve_type = portfolio.yieldcurve_types[code]
+        yieldcurve = curve_cache.get(yieldcurve_type)
+        if yieldcurve is None:
             yieldcurve = YieldCurve(curve_type=yieldcurve_type, today=today)
             yieldcurve.fit(market)
-            forward_yields = yieldcurve.get_floating_yields(repayment_dates=payment_dates,
-                                                             repricing_dates=reprice_dates)
-            rate = forward_yields['rate'].add(portfolio['spread'][id])
-        else:
-            rate = spread
-        
+            curve_cache[yieldcurve_type] = yieldcurve
+        # CALCULATE FLOATING YIELDS FOR ALL ASSETS ON THE CURVE AT ONCE
+        payment_offsets = np.cumsum([0] + [len(dates[k][0]) for k in assets])
+        reprice_offsets = np.cumsum([0] + [len(dates[k][1]) for k in assets])
+        floating_yields = yieldcurve.get_floating_yields_batched(
+            repayment_dates=np.concatenate([dates[k][0] for k in assets]),
+            repricing_dates=np.concatenate([dates[k][1] for k in assets]),
+            repayment_offsets=payment_offsets, repricing_offsets=reprice_offsets)
+        for k, asset_yields in zip(assets, np.split(floating_yields, payment_offsets[1:-1])):
+            rates[k] = asset_yields + rates[k]
+    
+    return [(rate / 10000)*(portfolio.payment_freq[i] / 12) for i, rate in zip(positions, rates)]
+
+
+def _asset_cashflow(portfolio, i, market, today, curve_cache):
+    """ Gets cashflow for the asset at position i of the PortfolioSoA, given the market """
+    payment_dates, reprice_dates = _asset_dates(portfolio, i, today)
+    monthly_rate, = _period_rates(portfolio, [i], [(payment_dates, reprice_dates)], market, today, curve_cache)
+    payment_dates = payment_dates.astype('datetime64[ns]')
     # CALCULATE CASHFLOWS
-    monthly_rate = (rate / 10000)*(payment_freq / 12)
     maturity = len(payment_dates)
-    volume = portfolio['volume'][id]
-    repayment = str(portfolio['repayment'][id])
+    volume = portfolio.volume[i]
+    repayment = str(portfolio.repayment_types[portfolio.repayment_code[i]])
     
     cashflows = amortization_schedule(rate=monthly_rate, maturity=maturity,
                                       volume=volume, payment_type=repayment)
-    info = {'id': [id] * cashflows.shape[0],
-            'account': [portfolio['account'][id]] * cashflows.shape[0],
+    info = {'id': [portfolio.id[i]] * cashflows.shape[0],
+            'account': [portfolio.account[i]] * cashflows.shape[0],
             'date': payment_dates} 
     cashflows = pd.concat([pd.DataFrame(info), cashflows], axis=1)
-    cashflows['date'] = cashflows['date'].dt.to_pydatetime()
-#     cashflows.insert(cashflows.shape[1], 'yieldcurve', [portfolio['yieldcurve'][id]] * cashflows.shape[0])
+#     cashflows.insert(cashflows.shape[1], 'yieldcurve', [portfolio.yieldcurve_types[portfolio.yieldcurve_code[i]]] * cashflows.shape[0])
     
     return cashflows
 
 
+def asset_cashflow(portfolio, market, id, today, curve_cache=None):
+    """ 
+    Gets cashflow for asset in portfolio (DataFrame or PortfolioSoA) with id, given the market.
+    Yield curves fitted on the market are stored in curve_cache by curve type,
+    so that they can be reused for other assets.
+    """
+    if curve_cache is None:
+        curve_cache = {}
+    portfolio, i = asset_to_soa(portfolio, id)
+    return _asset_cashflow(portfolio, i, market, today, curve_cache)
+
+
 def portfolio_cashflow(portfolio, market, today):
-    """ Gets cashflow for each asset in the portfolio and stacks them horizontally """
-    port_cashflow = pd.DataFrame()
-    for idx, _ in portfolio.iterrows():
-        cashflow = asset_cashflow(portfolio=portfolio, market=market, id=idx, today=today)
-        port_cashflow = pd.concat([port_cashflow, cashflow], ignore_index=True)
-    return port_cashflow
+    """ 
+    Gets cashflow for each asset in the portfolio (DataFrame or PortfolioSoA)
+    and stacks them horizontally
+    """
+    portfolio = portfolio_to_soa(portfolio)
+    for payment_type in portfolio.repayment_types:
+        if payment_type not in PAYMENT_TYPES:
+            raise TypeError("payment_type can be either BULLET, LINEAR or ANNUITY")
+    n_assets = len(portfolio.id)
+    # FIT EACH YIELD CURVE ONCE ON ITS OWN MARKET DATA AND SHARE IT ACROSS ASSETS
+    market = market_groups(market)
+    curve_cache = {}
+    # DETERMINE THE PAYMENT AND REPRICING DATES OF EACH ASSET, THEN THE RATES OF ALL ASSETS
+    dates = [_asset_dates(portfolio, i, today) for i in range(n_assets)]
+    rates = _period_rates(portfolio, range(n_assets), dates, market, today, curve_cache)
+    lengths = np.array([len(payment_dates) for payment_dates, _ in dates], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    # WRITE THE AMORTIZATION SCHEDULE OF EACH ASSET IN ITS OWN SLICE OF THE OUTPUT
+    amortization = np.empty((4, offsets[-1]))
+    for i, monthly_rate in enumerate(rates):
+        if lengths[i] == 0:
+            continue
+        repayment = portfolio.repayment_types[portfolio.repayment_code[i]]
+        arrays = _amortization_arrays(monthly_rate, lengths[i], portfolio.volume[i], repayment)
+        for row, values in zip(amortization, arrays):
+            row[offsets[i]:offsets[i+1]] = values
+    payment_dates = [np.asarray(payment_dates, dtype='datetime64[ns]') for payment_dates, _ in dates]
+    
+    cashflow, interest, capital, remaining = amortization
+    return pd.DataFrame({'id': np.repeat(portfolio.id, lengths),
+                         'account': np.repeat(portfolio.account, lengths),
+                         'date': np.concatenate([np.empty(0, dtype='datetime64[ns]'), *payment_dates]),
+                         'cashflow': cashflow, 'interest': interest,
+                         'capital': capital, 'remaining': remaining})
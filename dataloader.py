@@ -1,7 +1,37 @@
+import os
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 
-def load_portfolio():
+# COLUMN TYPES OF THE PORTFOLIO AND MARKET DATA, FIXED WHEN PARSING THE CSV FILES
+# THE LOW CARDINALITY STRING COLUMNS ARE STORED AS CATEGORICALS
+PORTFOLIO_DTYPES = {'id': np.int64, 'account': 'category', 'account_name': 'category', 'volume': np.float64,
+                    'ir_binding': 'category', 'reprice_freq': np.float64, 'spread': np.float64,
+                    'repayment': 'category', 'payment_freq': np.int64, 'yieldcurve': 'category'}
+MARKET_DTYPES = {'type': 'category', 'rate': np.float64, 'comment': 'category'}
+
+
+class PortfolioSoA(namedtuple('PortfolioSoA', ['id', 'account', 'volume', 'ir_binding_is_fix',
+                                               'reprice_freq', 'spread', 'issue', 'maturity',
+                                               'repayment_code', 'payment_freq', 'yieldcurve_code',
+                                               'repayment_types', 'yieldcurve_types'])):
+    """
+    Portfolio stored as parallel numpy arrays (structure of arrays), one per column.
+    The repayment and yieldcurve columns are stored as integer codes into
+    the repayment_types and yieldcurve_types tables.
+    """
+    __slots__ = ()
+
+    def position(self, id):
+        """ Returns the position of the asset with the given id """
+        position = np.flatnonzero(self.id == id)
+        if position.size == 0:
+            raise KeyError(id)
+        return position[0]
+
+
+def load_portfolio(as_soa=False):
     """
     :col id: identification number (the number ofthe row)
     :col account: account type in short
@@ -18,16 +48,51 @@ def load_portfolio():
     :col repayment: type of principal repayment structure (bullet, linear, or annuity)
     :col payment_freq: repayment frequency in number of months
     :col yieldcurve: identifier of the interest rate curve
+
+    If as_soa is True, the portfolio is returned as a PortfolioSoA
     """
-    portfolio = pd.read_csv('data/portfolio.csv')
-    portfolio.set_index('id', inplace=True)
-    portfolio['issue'] = pd.to_datetime(portfolio['issue'])
-    portfolio['maturity'] = pd.to_datetime(portfolio['maturity'])
-    portfolio['reprice_freq'] = portfolio['reprice_freq'].fillna(1).astype(int)
+    portfolio = _read_portfolio(*_file_key('data/portfolio.csv')).copy()
 
+    if as_soa:
+        return portfolio_to_soa(portfolio)
     return portfolio
 
 
+def portfolio_to_soa(portfolio):
+    """ Converts the portfolio DataFrame to a PortfolioSoA, a PortfolioSoA is returned as is """
+    if isinstance(portfolio, PortfolioSoA):
+        return portfolio
+    repayment_code, repayment_types = pd.factorize(portfolio['repayment'])
+    # LOADED PORTFOLIOS ALREADY HAVE INTEGER REPRICING FREQUENCIES, OTHERS MAY HAVE MISSING ONES
+    reprice_freq = portfolio['reprice_freq']
+    if reprice_freq.hasnans:
+        reprice_freq = reprice_freq.fillna(1)
+    yieldcurve_code, yieldcurve_types = pd.factorize(portfolio['yieldcurve'])
+    return PortfolioSoA(id=portfolio.index.to_numpy(),
+                        account=portfolio['account'].to_numpy(),
+                        volume=portfolio['volume'].to_numpy(np.float64),
+                        ir_binding_is_fix=(portfolio['ir_binding'] == 'FIX').to_numpy(),
+                        reprice_freq=reprice_freq.to_numpy(np.int64),
+                        spread=portfolio['spread'].to_numpy(np.float64),
+                        issue=portfolio['issue'].to_numpy('datetime64[D]'),
+                        maturity=portfolio['maturity'].to_numpy('datetime64[D]'),
+                        repayment_code=repayment_code.astype(np.int8),
+                        payment_freq=portfolio['payment_freq'].to_numpy(np.int64),
+                        yieldcurve_code=yieldcurve_code.astype(np.int16),
+                        repayment_types=np.asarray(repayment_types),
+                        yieldcurve_types=np.asarray(yieldcurve_types))
+
+
+def asset_to_soa(portfolio, id):
+    """ 
+    Returns the asset with the given id as a PortfolioSoA and its position in it.
+    Only the row of the asset is converted from a DataFrame, a PortfolioSoA is searched for the id
+    """
+    if isinstance(portfolio, PortfolioSoA):
+        return portfolio, portfolio.position(id)
+    return portfolio_to_soa(portfolio.loc[[id]]), 0
+
+
 def load_market():
     """
     :col type: yield curve type (for example, yields are from the bond market or the interbank market)
@@ -36,12 +101,45 @@ def load_market():
     :col rate: value of the rate in basis points
     :col comment: label of the yield curve tensor
     """ 
-    market = pd.read_csv('data/market.csv')
-    market['date'] = pd.to_datetime(market['date'])
-    market['rate'] = market['rate']
+    return _read_market(*_file_key('data/market.csv')).copy()
+
+
+def _file_key(path):
+    """ Returns the absolute path and modification time of the file, which identify the parsed data """
+    path = os.path.abspath(path)
+    return path, os.path.getmtime(path)
+
+
+@lru_cache(maxsize=4)
+def _read_portfolio(path, mtime):
+    """ Parses the portfolio CSV file once per file version, callers get a copy """
+    portfolio = pd.read_csv(path, dtype=PORTFOLIO_DTYPES)
+    portfolio.set_index('id', inplace=True)
+    portfolio['issue'] = pd.to_datetime(portfolio['issue'], format='%m/%d/%Y', cache=True)
+    portfolio['maturity'] = pd.to_datetime(portfolio['maturity'], format='%m/%d/%Y', cache=True)
+    portfolio['reprice_freq'] = portfolio['reprice_freq'].fillna(1).astype(np.int64)
+    return portfolio
+
+
+@lru_cache(maxsize=4)
+def _read_market(path, mtime):
+    """ Parses the market CSV file once per file version, callers get a copy """
+    market = pd.read_csv(path, dtype=MARKET_DTYPES)
+    market['date'] = pd.to_datetime(market['date'], format='%m/%d/%Y', cache=True)
     return market
 
 
+def market_groups(market):
+    """ 
+    Splits the market data into a dict of DataFrames by yield curve type,
+    so that each curve finds its yields without scanning the whole market.
+    A dict of groups is returned as is
+    """
+    if isinstance(market, dict):
+        return market
+    return dict(tuple(market.groupby('type', sort=False, observed=True)))
+
+
 def load_non_maturity_deposits(plot=False):
     """
       Loads Austrian non-maturity deposits data 
@@ -54,6 +152,7 @@ def load_non_maturity_deposits(plot=False):
     data['date'] = pd.to_datetime(data['date'], format='%m/%d/%Y')
 
     if plot:
+        from matplotlib import pyplot as plt
         fig, ax = plt.subplots(figsize=(10, 5))
         ax.plot(data['date'], data['eur1m'], linestyle='-', label='EUR1M')
         ax.plot(data['date'], data['cpn'], linestyle='--', label='Coupon')
@@ -77,6 +176,7 @@ def load_yields(plot=False):
     data['date'] = pd.to_datetime(data['date'], format='%d/%m/%Y')
 
     if plot:
+        from matplotlib import pyplot as plt
         fig, ax = plt.subplots(figsize=(10, 6))
         ax.plot(data['date'], data['EUR10Y'], label='eur1m')
         for col in data.columns.drop('date'):
@@ -1,27 +1,27 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from dateutil.relativedelta import relativedelta
 import timeutils
+from dataloader import portfolio_to_soa, asset_to_soa
 from yieldcurve import YieldCurve
 
 
 def get_present_values(cashflows, market, today):
     """ Get present values for future cashflows """
-    table = cashflows.copy()[['id','account','date','cashflow']]
-    payment_dates = [date.to_pydatetime() for date in table['date']]
-    # GET YIELDS ON PAYMENT DATES
-    yieldcurve = YieldCurve(curve_type='EUR01', today=today)
-    yieldcurve.fit(market)
-    spot_yields = yieldcurve.get_spot_yields(payment_dates)['rate']
+    payment_dates = cashflows['date'].to_numpy(dtype='datetime64[ns]')
     # CALCULATE TIME FROM TODAY TO PAYMENT IN YEARS
     dt = timeutils.time_difference_from_list(payment_dates, today, 'years')
+    # GET YIELDS ON PAYMENT DATES, REUSING THE TIMES TO PAYMENT AS MATURITIES
+    yieldcurve = YieldCurve(curve_type='EUR01', today=today)
+    yieldcurve.fit(market)
+    spot_yields = yieldcurve._spot_yields_core(dt)
     # DISCOUNT THE CASHFLOW ON GIVEN DATE TO FIND ITS PRESENT VALUE
-    df = (1 + spot_yields/10000)**(-dt)
-    table['present_values'] = table['cashflow'] * df
-    
-    table = table[['id', 'account', 'present_values']]
-    table = table.groupby(['id', 'account']).sum().reset_index().set_index('id')
+    present_values = cashflows['cashflow'].to_numpy() * (1 + spot_yields/10000)**(-dt)
+    table = pd.DataFrame({'id': cashflows['id'].to_numpy(),
+                          'account': cashflows['account'].to_numpy(),
+                          'present_values': present_values})
+
+    table = table.groupby(['id', 'account'], observed=True).sum().reset_index(level='account')
     table.insert(1, 'date', np.full(table.shape[0],  today))
  
     return table
@@ -29,17 +29,19 @@ def get_present_values(cashflows, market, today):
 
 def nii_table(cashflow_table, today, plot=False):
     """ Returns table that breaks down the Net Interest Income (NII) """
-    table = cashflow_table.pivot_table(index='date', columns='account', values='interest', aggfunc='sum').reset_index()
-    table = table[table['date'] >= today]
+    cashflow_table = cashflow_table[cashflow_table['date'] >= today]
+    table = cashflow_table.groupby(['date', 'account'], observed=True)['interest'].sum()
+    table = table.unstack('account', fill_value=0.0)
     
-    # Explicitly select numeric columns (excluding 'date' column) for the sum
-    numeric_cols = table.select_dtypes(include=['number']).columns
-    table['total'] = table[numeric_cols].sum(axis=1)
+    # Sum the interest of all accounts on each date in numpy
+    table['total'] = table.to_numpy(copy=False).sum(axis=1)
+    table = table.reset_index()
     
     table['year'] = table['date'].dt.year
-    nii_table = table.groupby('year').sum().T
+    nii_table = table.drop(columns='date').groupby('year', sort=False).sum().T
 
     if plot:
+        import matplotlib.pyplot as plt
         # Set up the figure and axis
         fig, ax = plt.subplots(figsize=(12, 8))
 
@@ -70,41 +72,36 @@ def nii_table(cashflow_table, today, plot=False):
     return nii_table
 
 
+def _reprice_days(portfolio, i, today):
+    """ Returns the days from today to each future repricing date of the asset at position i """
+    if portfolio.ir_binding_is_fix[i]:
+        return np.empty(0, dtype=int)
+    today_date = np.datetime64(today, 'D')
+    # DETERMINE REPRICING DATES
+    reprice_periods = timeutils.month_range(start=portfolio.issue[i], end=portfolio.maturity[i], step=1)
+    reprice_freq = portfolio.reprice_freq[i]
+    reprice_dates = reprice_periods[::reprice_freq]
+    reprice_dates = reprice_dates[reprice_dates >= today_date]
+    return (reprice_dates - today_date).astype(int)
+
+
+def _repricing_gap(portfolio, i, today, months_forward):
+    """ Returns the volume of the asset at position i of the PortfolioSoA repriced in each month """
+    months = _reprice_days(portfolio, i, today) // 30
+    return np.bincount(months, minlength=months_forward)[:months_forward] * portfolio.volume[i]
+
+
 def repricing_gap(portfolio, id, today, months_forward=12):
     """ 
     Calculate repricing gaps of the asset with given id in the given portfolio
-    for the months_forard next months
+    (DataFrame or PortfolioSoA) for the months_forard next months
     """
     # CHECK IF months_forward HAS PROPER TYPE
     if not isinstance(months_forward, int):
         raise ValueError("months_forward must be an integer")
-    # DETERMINE PAYMENT DATES
-    maturity_date = portfolio.at[id, 'maturity'].to_pydatetime()
-    payment_periods = timeutils.date_range(start=maturity_date, end=today, step=1)
-    payment_freq = portfolio.at[id, 'payment_freq']
-    payment_dates = payment_periods[::payment_freq]
-    
-    # IF VOLUME THAT IS AFFECTED FROM INTEREST RATE CHANGES FOR EACH MONTH
-    if portfolio.at[id, 'ir_binding'] == "FIX":
-        volume = np.zeros(months_forward)
-    else:
-        # DETERMINE REPRICING DATES
-        issue_date = portfolio.at[id, 'issue'].to_pydatetime()
-        reprice_periods = timeutils.date_range(start=issue_date, end=maturity_date, step=1)
-        reprice_freq = portfolio.at[id, 'reprice_freq']
-        reprice_dates = pd.Series(reprice_periods[::reprice_freq])
-        reprice_dates = reprice_dates[reprice_dates >= today]
-        
-        if reprice_dates.empty:
-            volume = np.zeros(months_forward)
-        else:
-            reprice_days = timeutils.time_difference_from_list(reprice_dates, today, 'days')
-            # DETERMINE THE VOLUME FOR EACH MONTH
-            idx = np.digitize(reprice_days, np.arange(months_forward+1) * 30)
-            volume = (np.bincount(idx[idx<=months_forward], 
-                      minlength=months_forward+1)[:months_forward+1] * portfolio.at[id, 'volume'])
-    
-    return pd.DataFrame({'volume': volume}).drop(0)
+    portfolio, i = asset_to_soa(portfolio, id)
+    volume = _repricing_gap(portfolio, i, today, months_forward)
+    return pd.DataFrame({'volume': volume}, index=range(1, months_forward+1))
 
 
 def repricing_gap_table(portfolio, today, months_forward=12, plot=False):
@@ -112,12 +109,26 @@ def repricing_gap_table(portfolio, today, months_forward=12, plot=False):
     Calculate repricing gap table, that is, 
     repricing gap for each month (#months_forward) after doday
     """
-    repricing_gaps = [repricing_gap(portfolio, i, today, months_forward) for i in portfolio.index]
-    total_gap = pd.concat(repricing_gaps, axis=1).sum(axis=1)
-    repricing_gap_df = pd.DataFrame(total_gap, columns=["volume"]).T
-    repricing_gap_df.columns = [str(i) + "M" for i in range(1, months_forward+1)]
+    # CHECK IF months_forward HAS PROPER TYPE
+    if not isinstance(months_forward, int):
+        raise ValueError("months_forward must be an integer")
+    portfolio = portfolio_to_soa(portfolio)
+    n_assets = len(portfolio.id)
+    # DETERMINE THE MONTH OF EACH REPRICING DATE FOR ALL ASSETS AT ONCE
+    reprice_days = [_reprice_days(portfolio, i, today) for i in range(n_assets)]
+    asset_idx = np.repeat(np.arange(n_assets), [len(days) for days in reprice_days])
+    month_idx = np.concatenate([np.empty(0, dtype=int), *reprice_days]) // 30
+    in_horizon = month_idx < months_forward
+    asset_idx, month_idx = asset_idx[in_horizon], month_idx[in_horizon]
+    # ACCUMULATE THE REPRICED VOLUME OF EACH ASSET IN EACH MONTH
+    gaps = np.zeros((n_assets, months_forward))
+    np.add.at(gaps, (asset_idx, month_idx), portfolio.volume[asset_idx])
+    total_gap = gaps.sum(axis=0)
+    repricing_gap_df = pd.DataFrame([total_gap], index=["volume"],
+                                    columns=[str(i) + "M" for i in range(1, months_forward+1)])
     
     if plot:
+        import matplotlib.pyplot as plt
         plt.bar(repricing_gap_df.columns, repricing_gap_df.iloc[0], color='gray')
         plt.xlabel('Months')
         plt.ylabel('EUR')
@@ -1,5 +1,5 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 from dateutil.relativedelta import relativedelta
 from yieldcurve import YieldCurve
 
@@ -9,13 +9,20 @@ def liquidity_table(cashflow_table, today, plot=False):
     periods_names = ["1M", "2-3M", "3-6M", "6-12M", "1-2Y", "2-5Y", "5-10Y", ">10Y"]
 
     cashflow_table = cashflow_table[cashflow_table['date'] >= today]
-    cashflows_by_date = cashflow_table.groupby(['date','account']).sum()['cashflow'].reset_index()
-    cashflows_by_date['days'] = (cashflows_by_date['date'] - today).dt.days
-    cashflows_by_date['period'] = pd.cut(cashflows_by_date['days'], bins=periods_days, labels=periods_names, right=True)
-    liquidity_table = cashflows_by_date.groupby(['period','account']).sum().drop(columns=['days']).reset_index()
-    liquidity_table = pd.pivot(liquidity_table, index='account', columns='period', values='cashflow')
+    days = (cashflow_table['date'] - today).dt.days.to_numpy()
+    # DETERMINE THE BUCKET OF EACH CASHFLOW, BUCKETS ARE CLOSED ON THE RIGHT
+    period_idx = np.searchsorted(periods_days, days, side='left') - 1
+    in_period = (period_idx >= 0) & (period_idx < len(periods_names))
+    account_idx, accounts = pd.factorize(cashflow_table['account'], sort=True)
+    # SUM THE CASHFLOWS OF EACH ACCOUNT IN EACH BUCKET
+    liquidity_table = np.zeros((len(accounts), len(periods_names)))
+    np.add.at(liquidity_table, (account_idx[in_period], period_idx[in_period]),
+              cashflow_table['cashflow'].to_numpy()[in_period])
+    liquidity_table = pd.DataFrame(liquidity_table, index=pd.Index(accounts, name='account'),
+                                   columns=pd.CategoricalIndex(periods_names, ordered=True, name='period'))
 
     if plot:
+        import matplotlib.pyplot as plt
         # Calculate liquidity gap for each time bucket
         liquidity_gap = liquidity_table.sum(axis=0)
         # Calculate net liquidity position as cumulative liquidity gap
@@ -1,14 +1,23 @@
+from functools import lru_cache
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 from statsmodels.tsa.stattools import adfuller, kpss
 from scipy.optimize import minimize
 
-def adf_test(timeseries, verbose=False):
-    """ Returns the results for the Augmented Dickey-Fuller Test """
+@lru_cache(maxsize=32)
+def _adfuller(values, maxlag):
+    """ Runs adfuller on the raw bytes of the series values, so that results can be cached """
+    return adfuller(np.frombuffer(values), maxlag=maxlag, autolag='AIC')
+
+def adf_test(timeseries, verbose=False, maxlag=None):
+    """ 
+    Returns the results for the Augmented Dickey-Fuller Test,
+    selecting the lags up to maxlag with AIC
+    """
     if verbose:
         print('Results of Dieke-Fuller Test:')
-    dftest = adfuller(timeseries, autolag='AIC')
+    values = np.ascontiguousarray(timeseries, dtype=np.float64)
+    dftest = _adfuller(values.tobytes(), maxlag)
     dfoutput = pd.Series(dftest[0:4], index=['Test Statistic','p-value','#Lags Used','Number of Observations Used'])
     for key, value in dftest[4].items():
         dfoutput[f'Critical Value ({key})'] = value
@@ -27,22 +36,17 @@ def kpss_test(timeseries, verbose=False):
 
 def determine_order_of_integration(series, max_diff=3):
     """ Determines the order of integration for a given time series """
-    d = 0  # initial order of integration
-    while d <= max_diff:
-        # If d is 0, we test the series itself
-        if d == 0:
-            test_series = series
-        # Otherwise, we difference the series
-        else:
-            test_series = series.diff(periods=d).dropna()
+    # Keep the maximum number of lags of the ADF test fixed for all differences
+    maxlag = int(np.ceil(12 * (len(series) / 100) ** 0.25))
+    test_series = series  # d = 0, we test the series itself
+    for d in range(max_diff + 1):
         # Perform ADF test
-        p_value = adf_test(test_series)['p-value']
-        print(d, p_value)
+        p_value = adf_test(test_series, maxlag=min(maxlag, len(test_series) // 2 - 2))['p-value']
         # If p-value is less than 0.05, we consider the series stationary
         if p_value < 0.05:
             return d
-        else:
-            d += 1
+        # Otherwise, we difference the already differenced series once more
+        test_series = test_series.diff().dropna()
             
     return None  # None indicates that the series is not stationary even after max_diff differences
 
@@ -60,6 +64,7 @@ def replicate_portfolio(yields, coupons, objective_function='quadratic',
 
     # Plot the yields and coupons for common dates
     if plot:
+        from matplotlib import pyplot as plt
         fig, ax = plt.subplots(2,1, figsize=(10, 6))
         for col in ylds.columns.drop('date'):
             ax[0].plot(ylds['date'], ylds[col], label=col)
@@ -71,20 +76,31 @@ def replicate_portfolio(yields, coupons, objective_function='quadratic',
 
     # Turn yields and coupons into numpy arrays
     ylds_np = ylds.drop(columns='date').to_numpy()
-    cpns_np = cpns.drop(columns='date').to_numpy()
+    cpns_np = cpns.drop(columns='date').to_numpy().ravel()
 
     # Months to maturity
     maturities = np.array([1, 3, 12, 60, 120])
     yields_num = len(maturities)
     
-    # Define the quadratic objective function
-    def objective_func(weights, A, b):
+    # Precompute the normal equations once, 0.5*||Aw - b||^2 = 0.5*w'Hw - w'c + 0.5*b'b
+    H = ylds_np.T @ ylds_np
+    c = ylds_np.T @ cpns_np
+    bb = cpns_np @ cpns_np
+
+    # Define the quadratic objective function and its gradient
+    def objective_func(weights):
+        if objective_function == 'quadratic':
+            return 0.5 * (weights @ H @ weights) - weights @ c + 0.5 * bb
+
+    def objective_jac(weights):
         if objective_function == 'quadratic':
-            return np.linalg.norm(np.dot(A, weights) - b)
+            return H @ weights - c
     
     # Constraints
-    constraints = [{"type": "eq", "fun": lambda weights: np.sum(weights) - 1},
-                   {"type": "eq", "fun": lambda weights: np.dot(maturities, weights) - mean_maturity}]
+    constraints = [{"type": "eq", "fun": lambda weights: np.sum(weights) - 1,
+                    "jac": lambda weights: np.ones_like(weights)},
+                   {"type": "eq", "fun": lambda weights: np.dot(maturities, weights) - mean_maturity,
+                    "jac": lambda weights: maturities.astype(float)}]
     # Boundaries for weights (0,1)
     bounds = [(0, 1) for _ in range(yields_num)]
 
@@ -93,7 +109,8 @@ def replicate_portfolio(yields, coupons, objective_function='quadratic',
         initial_weights = np.ones(yields_num) / yields_num
 
     # Solve the optimization problem
-    result = minimize(objective_func, initial_weights, args=(ylds_np, cpns_np), bounds=bounds, constraints=constraints)
+    result = minimize(objective_func, initial_weights, jac=objective_jac,
+                      bounds=bounds, constraints=constraints)
     print(result)
     weights = pd.DataFrame(result.x, index = yields.columns.drop('date'), columns=['weight'])
  
@@ -1,31 +1,37 @@
 import warnings
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(date):
+    """ Parses a string with the format %Y-%m-%d, caching the datetimes of repeated strings """
+    return datetime.strptime(date, "%Y-%m-%d")
 
 
 def set_today(date=datetime(2014,9,30)):
     """ Set today's date """
-    if not isinstance(date, (datetime, str)):
+    if isinstance(date, datetime):
+        return date
+    if not isinstance(date, str):
         raise TypeError("date can be either datetime or a string with the format %Y-%m-%d")
-    if isinstance(date, str):
-        date = datetime.strptime(date, "%Y-%m-%d")
-    return date
+    return _parse_date(date)
 
 
 def time_difference(date, from_date, unit):
     """ Calculates time defference of date from from_date in years """
     # CHECK IF date TYPE IS PROPER
     if isinstance(date, str):
-        date = datetime.strptime(date, "%Y-%m-%d")
+        date = _parse_date(date)
     elif isinstance(date, datetime):
         pass
     else:
         raise ValueError(f"""Dates have to be either strings or datetimes. Instead, it is {type(date)}""")
     # CHECK IF from_date TYPE IS PROPER  
     if isinstance(from_date, str):
-        from_date = datetime.strptime(from_date, "%Y-%m-%d")
+        from_date = _parse_date(from_date)
     elif isinstance(from_date, datetime):
         pass
     else:
@@ -45,15 +51,26 @@ def time_difference(date, from_date, unit):
 def time_difference_from_list(dates, from_date, unit):
     """ Calculated time differences in years for list of dates """
     # CHECK IF TYPE OF dates IS PROPER
-    if isinstance(dates, pd.Series):
-        dates = [pd.to_datetime(d).to_pydatetime() for d in np.ravel(dates)]
-    elif isinstance(dates, list):
-        pass
-    else:
-        raise TypeError("dates can be either a list or pandas.Series of datetimes")
-    # CALCULATE TIME DIFFERENCES
-    vectorized_time_difference = np.vectorize(time_difference, excluded=['from_date', 'unit'])
-    time_differences = vectorized_time_difference(dates, from_date=from_date, unit=unit)
+    if not isinstance(dates, (list, pd.Series, np.ndarray)):
+        raise TypeError("dates can be either a list, numpy.ndarray or pandas.Series of datetimes")
+    # CHECK IF unit TYPE IS PROPER
+    if unit not in ['years', 'days']:
+        raise ValueError("unit of time can be either 'years' or 'days'")
+    # CHECK IF from_date TYPE IS PROPER
+    if isinstance(from_date, str):
+        from_date = _parse_date(from_date)
+    elif not isinstance(from_date, (datetime, np.datetime64)) or pd.isna(from_date):
+        raise ValueError(f"""Dates have to be either strings or datetimes. Instead, it is {type(from_date)}""")
+    
+    # CALCULATE TIME DIFFERENCES IN WHOLE DAYS FOR ALL DATES AT ONCE
+    dates = pd.to_datetime(np.ravel(dates)).to_numpy(dtype='datetime64[ns]')
+    time_differences = (dates - np.datetime64(from_date, 'ns')) // np.timedelta64(1, 'D')
+    # MISSING DATES HAVE NO TIME DIFFERENCE
+    missing = np.isnat(dates)
+    if missing.any():
+        time_differences = np.where(missing, np.nan, time_differences)
+    if unit == 'years':
+        time_differences = time_differences / 365.25
     return time_differences
 
  
@@ -69,7 +86,9 @@ def date_range(start=None, end=None, length=None, step=None):
         
     # CHECK IF start HAS PROPER TYPE
     if isinstance(start, str):
-        start = datetime.strptime(start, '%Y-%m-%d')
+        start = _parse_date(start)
+    elif isinstance(start, np.datetime64):
+        start = pd.Timestamp(start).to_pydatetime()
     elif isinstance(start, pd._libs.tslibs.timestamps.Timestamp):
         start = start.to_pydatetime()
     elif isinstance(start, datetime) or (start is None):
@@ -79,7 +98,9 @@ def date_range(start=None, end=None, length=None, step=None):
     
     # CHECK IF end HAS PROPER TYPE
     if isinstance(end, str):
-        end = datetime.strptime(end, '%Y-%m-%d')
+        end = _parse_date(end)
+    elif isinstance(end, np.datetime64):
+        end = pd.Timestamp(end).to_pydatetime()
     elif isinstance(end, pd._libs.tslibs.timestamps.Timestamp):
         start = end.to_pydatetime()
     elif isinstance(end, datetime) or (end is None):
@@ -98,44 +119,65 @@ def date_range(start=None, end=None, length=None, step=None):
     # START - END - LENGTH
     if (start is not None) and (end is not None) and (length is not None):
         time_difference = end - start
-        interval = time_difference / (length - 1)
-        if start < end:
-            date_range = [start + i * interval for i in range(length)]
-        else:
-            date_range = [start - i * interval for i in range(length)]
+        interval = np.timedelta64(time_difference / (length - 1))
+        # THE INTERPOLATED DATES ARE TRUNCATED TO THE DAY
+        dates = np.datetime64(start, 'us') + np.arange(length) * interval
+        date_range = dates.astype('datetime64[D]').astype('datetime64[us]').tolist()
     
     # START - LENGTH - STEP
     elif (start is not None) and (end is None) and (length is not None) and (step is not None):
-        date_range = []
-        current_date = start
-        for _ in range(length):
-            date_range.append(current_date)
-            current_date += relativedelta(months=step)
+        date_range = _month_steps(start, step, length).astype('datetime64[us]').tolist()
             
     # END - LENGTH - STEP
     elif (end is not None) and (length is not None) and (step is not None) and (start is None):
-        date_range = []
-        current_date = end
-        for _ in range(length):
-            date_range.append(current_date)
-            current_date -= relativedelta(months=step)
+        date_range = _month_steps(end, -step, length).astype('datetime64[us]').tolist()
         
     # START - END - STEP
     elif (start is not None) and (end is not None) and (step is not None):
-        date_range = []
-        current_date = start
-        if start < end:
-            while current_date <= end:
-                date_range.append(current_date)
-                current_date += relativedelta(months=step)
-        else:
-            while current_date >= end:
-                date_range.append(current_date)
-                current_date -= relativedelta(months=step)
+        if start >= end:
+            step = -step
+        n_months = abs((end.year - start.year) * 12 + end.month - start.month)
+        # DATES ARE COMPARED WITH end AT THE TIME OF DAY OF start, AS IN THE STEPS OF start
+        time_of_day = np.timedelta64(start - datetime(start.year, start.month, start.day))
+        dates = _month_steps(start, step, n_months // abs(step) + 1).astype('datetime64[us]')
+        in_range = (dates + time_of_day <= np.datetime64(end)) if step > 0 else (dates + time_of_day >= np.datetime64(end))
+        date_range = dates[in_range].tolist()
     
     else:
         raise ValueError("""There are only four valid combinations of parameters (start, end, length),
                          (start, length, step), (end, length, step) or (start, end, step)""")
     
-    date_range = [datetime(d.year, d.month, d.day) for d in date_range]
     return date_range
+
+
+def _month_steps(start, step, length):
+    """ 
+    Returns #length datetime64[D] dates starting from start and moving step months at a time.
+    As with successive relativedelta steps, once the day is clipped to the end of a shorter month
+    it stays clipped for the following dates.
+    """
+    start = np.datetime64(start, 'D')
+    # MONTHS OF THE DATES
+    start_month = start.astype('datetime64[M]')
+    months = start_month + np.arange(length) * step
+    # DAYS OF THE DATES, CLIPPED TO THE END OF EACH MONTH AND ALL PREVIOUS MONTHS
+    days_in_month = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+    start_day = (start - start_month.astype('datetime64[D]')).astype(int) + 1
+    days = np.minimum.accumulate(np.minimum(days_in_month, start_day))
+    return months.astype('datetime64[D]') + (days - 1)
+
+
+def month_range(start, end, step=1):
+    """ 
+    Returns the datetime64[D] dates from start to end (inclusive) moving step months at a time,
+    which are the same dates as date_range(start=start, end=end, step=step)
+    """
+    if not isinstance(step, (int, np.integer)) or step == 0:
+        raise TypeError("Non-zero integer step must be provided")
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    step = abs(step) if start <= end else -abs(step)
+    n_months = (end.astype('datetime64[M]') - start.astype('datetime64[M]')).astype(int)
+    dates = _month_steps(start, step, n_months // step + 1)
+    
+    return dates[dates <= end] if step > 0 else dates[dates >= end]
@@ -1,11 +1,81 @@
 import numpy as np
 import pandas as pd
-from datetime import datetime
-import matplotlib.pyplot as plt
 
 import timeutils
+from nelson_siegel_svensson import NelsonSiegelSvenssonCurve
 from nelson_siegel_svensson.calibrate import calibrate_nss_ols
 
+# NANOSECONDS IN A DAY, TO COUNT WHOLE DAYS ON INT64 TIMESTAMPS
+NS_PER_DAY = 86400 * 10**9
+
+
+def _nss(maturities, beta0, beta1, beta2, beta3, tau1, tau2):
+    """ 
+    Evaluates the Nelson-Siegel-Svensson curve with the given parameters on an array of maturities,
+    the same as the fitted NelsonSiegelSvenssonCurve but without modifying the maturities
+    """
+    # MATURITIES UP TO ZERO TAKE THE LIMIT OF THE FACTORS AT ZERO
+    positive = maturities > 0
+    maturities = np.where(positive, maturities, 1.0)
+    # SCALED MATURITIES AND THEIR EXPONENTIALS, EACH COMPUTED ONCE
+    scaled1 = maturities / tau1
+    scaled2 = np.divide(maturities, tau2, out=maturities)
+    exp1 = np.exp(-scaled1)
+    exp2 = np.exp(-scaled2)
+    # ACCUMULATE THE FACTORS INTO THE YIELDS IN PLACE, REUSING THE TEMPORARY ARRAYS
+    factor1 = np.divide(1 - exp1, scaled1, out=scaled1)
+    factor3 = np.divide(1 - exp2, scaled2, out=scaled2)
+    factor3 -= exp2
+    yields = beta1 * factor1
+    yields += beta0
+    factor1 -= exp1
+    factor1 *= beta2
+    yields += factor1
+    factor3 *= beta3
+    yields += factor3
+    yields[~positive] = beta0 + beta1
+    return yields
+
+
+def _forward_yields(yields, maturities, starts=slice(0, 1)):
+    """ 
+    Returns the forward yields between consecutive maturities given the spot yields on them.
+    At the positions in starts (the first one by default) the forward yield is the spot yield
+    """
+    # INTEREST COMPOUNDED UP TO EACH MATURITY AS exp(maturity * log1p(yield)),
+    # PAST DATES COMPOUND OVER ZERO YEARS
+    interests = yields / 10000
+    np.log1p(interests, out=interests)
+    interests *= np.maximum(maturities, 0)
+    np.exp(interests, out=interests)
+    # GROWTH OF THE INTEREST FROM THE PREVIOUS MATURITY, TURNED INTO YIELDS IN PLACE
+    forwards = np.empty_like(interests)
+    np.divide(interests[1:], interests[:-1], out=forwards[1:])
+    forwards[starts] = interests[starts]
+    forwards -= 1
+    forwards *= 10000
+    return forwards
+
+
+def _sorted_dates(dates):
+    """ Returns the dates as a sorted datetime64[ns] array, sorting them only if they are not sorted yet """
+    dates = pd.to_datetime(np.ravel(dates)).to_numpy(dtype='datetime64[ns]')
+    if np.any(dates[1:] < dates[:-1]):
+        dates = np.sort(dates)
+    return dates
+
+
+def _yields_table(dates, rates, return_ndarray=False):
+    """ 
+    Returns the yields on dates as a DataFrame with date and rate columns or,
+    if return_ndarray is True, as a structured numpy array with the same fields
+    """
+    if return_ndarray:
+        table = np.empty(len(rates), dtype=[('date', 'datetime64[ns]'), ('rate', np.float64)])
+        table['date'] = dates
+        table['rate'] = rates
+        return table
+    return pd.DataFrame({"date": dates, "rate": rates})
 
 
 class YieldCurve:
@@ -13,52 +83,157 @@ class YieldCurve:
     def __init__(self, curve_type, today):
         """ Initialize parameters """
         self.curve_type = curve_type
-        self._data = None
-        self._curve = None
+        self._fit_maturities = None
+        self._fit_rates = None
+        self._params = None
+        self._values_cache = {}
         self._status = None
         self._today = today
+        # TODAY IN INT64 NANOSECONDS, SUBTRACTED FROM THE INT64 VIEW OF THE DATES
+        self._today_ns = np.datetime64(today, 'ns').view(np.int64)
         
         
     def fit(self, market_data, plot=False):
-        """ Fit Nelson-Siegel-Svensson model to the observed yields on the market """
-        self._data = market_data[market_data['type'] == self.curve_type].copy()
+        """ 
+        Fit Nelson-Siegel-Svensson model to the observed yields on the market,
+        given as a DataFrame or as a dict of DataFrames by curve type (see dataloader.market_groups)
+        """
+        # Take the dates and rates of the curve as arrays, without copying the market data
+        if isinstance(market_data, dict):
+            dates = market_data[self.curve_type]['date'].to_numpy()
+            rates = market_data[self.curve_type]['rate'].to_numpy(np.float64, copy=True)
+        else:
+            mask = (market_data['type'] == self.curve_type).to_numpy()
+            dates = market_data['date'].to_numpy()[mask]
+            rates = market_data['rate'].to_numpy(np.float64)[mask]
         # Calculate time difference in years between now and expiry
-        self._data['maturity'] = self._data['date'].apply(lambda date: timeutils.time_difference(date, self._today, 'years'))
+        self._fit_arrays(self._maturities(dates), rates, plot=plot)
+        
+        
+    @classmethod
+    def fit_all(cls, market_data, today):
+        """ 
+        Fits the yield curves of all types in the market data with one pass over it,
+        returns a dict of fitted YieldCurves by curve type
+        """
+        # Calculate the maturities of the whole market at once and split them by curve type
+        maturities = timeutils.time_difference_from_list(market_data['date'].to_numpy(), today, 'years')
+        rates = market_data['rate'].to_numpy(np.float64)
+        curves = {}
+        for curve_type, idx in market_data.groupby('type', sort=False, observed=True).indices.items():
+            curves[curve_type] = cls(curve_type=curve_type, today=today)
+            curves[curve_type]._fit_arrays(maturities[idx], rates[idx])
+        return curves
+        
+        
+    def _fit_arrays(self, maturities, rates, plot=False):
+        """ Fits the Nelson-Siegel-Svensson model to yields with the given maturities in years """
+        self._fit_maturities = maturities
+        self._fit_rates = rates
+        self._values_cache = {}
         # Fit the Nelson-Siegel-Svensson model to our yield data
-        self._curve, self._status = calibrate_nss_ols(np.ravel(self._data['maturity']), np.ravel(self._data['rate']))
+        curve, self._status = calibrate_nss_ols(self._fit_maturities, self._fit_rates)
+        # ONLY THE FITTED PARAMETERS ARE KEPT, THE GETTERS EVALUATE THEM WITH _nss
+        self._params = tuple(float(param) for param in (curve.beta0, curve.beta1, curve.beta2, curve.beta3,
+                                                        curve.tau1, curve.tau2))
 
         if plot:
-            self._plot_spot_yields(self._data['maturity'], self._data['rate'])
+            self._plot_spot_yields(self._fit_maturities, self._fit_rates)
         
         
-    def get_spot_yields(self, dates, plot=False):
+    @property
+    def curve(self):
+        """ The fitted NelsonSiegelSvenssonCurve, rebuilt from the fitted parameters (None before fitting) """
+        if self._params is None:
+            return None
+        return NelsonSiegelSvenssonCurve(*self._params)
+        
+        
+    def _maturities(self, dates):
+        """ 
+        Returns the time in years from today to the dates, counted in whole days as timeutils.time_difference.
+        Arrays of datetime64 are subtracted directly, other inputs go through timeutils.
+        Missing dates have NaN maturities
+        """
+        if not (isinstance(dates, np.ndarray) and dates.dtype.kind == 'M'):
+            return timeutils.time_difference_from_list(dates, self._today, 'years')
+        dates = dates.astype('datetime64[ns]', copy=False)
+        days = (dates.view(np.int64) - self._today_ns) // NS_PER_DAY
+        # NaT IS THE SMALLEST INT64, IT IS MASKED INSTEAD OF SUBTRACTED
+        missing = np.isnat(dates)
+        if missing.any():
+            return np.where(missing, np.nan, days / 365.25)
+        return days / 365.25
+        
+        
+    def _spot_yields_core(self, maturities):
+        """ Gets the spot yields for maturities in years from today as a numpy array """
+        return _nss(maturities, *self._params)
+        
+        
+    def _forward_yields_core(self, maturities):
+        """ Gets the forward yields between consecutive maturities in years from today as a numpy array """
+        return _forward_yields(_nss(maturities, *self._params), maturities)
+        
+        
+    def _curve_values(self, dates):
+        """ 
+        Returns the maturities and spot yields on dates. For datetime64 arrays they are cached
+        by the content of the array, so repeated evaluations on the same dates are computed once.
+        The cache keeps the last 8 arrays and is cleared when the curve is fitted again
+        """
+        if not (isinstance(dates, np.ndarray) and dates.dtype.kind == 'M'):
+            maturities = self._maturities(dates)
+            return maturities, self._spot_yields_core(maturities)
+        key = (dates.dtype.str, dates.tobytes())
+        values = self._values_cache.get(key)
+        if values is None:
+            maturities = self._maturities(dates)
+            values = (maturities, self._spot_yields_core(maturities))
+            if len(self._values_cache) >= 8:
+                self._values_cache.pop(next(iter(self._values_cache)))
+            self._values_cache[key] = values
+        return values
+        
+        
+    def get_spot_yields_array(self, dates):
+        """ Gets the spot yields for dates as a numpy array, without building a DataFrame """
+        _, yields = self._curve_values(dates)
+        return yields.copy()
+        
+        
+    def get_spot_yields(self, dates, plot=False, return_ndarray=False):
         """ Gets the spot yield for dates based on Nelson-Siegel-Svensson model """
-        maturities = timeutils.time_difference_from_list(dates, self._today, 'years')
-        yields = self._curve(maturities)
+        yields = self.get_spot_yields_array(dates)
         if plot:
             self._plot_spot_yields(dates, yields)
-        return pd.DataFrame({"date": dates, "rate": yields})
+        return _yields_table(dates, yields, return_ndarray)
          
         
     def _plot_spot_yields(self, times, rates):
         """ Plots the yields and the Nelson-Siegel-Svensson model vs dates of maturity """ 
-        if isinstance(times[0], datetime):
+        # Matplotlib is only imported when plotting
+        import matplotlib.pyplot as plt
+        # DISPATCH ON THE DTYPE OF THE TIMES, EITHER DATES OR MATURITIES IN YEARS
+        times = pd.Series(times).to_numpy()
+        if np.issubdtype(times.dtype, np.datetime64):
             times_type = 'dates'
             times_scale = ''
-            continuous_dates = timeutils.date_range(np.min(times), np.max(times), 100)
-            continuous_maturities = timeutils.time_difference_from_list(continuous_dates, self._today, 'years')
+            continuous_dates = np.linspace(times.min().astype(np.int64), times.max().astype(np.int64), 100)
+            continuous_dates = continuous_dates.astype(np.int64).astype('datetime64[ns]')
+            continuous_maturities = self._maturities(continuous_dates)
             continuous_times = continuous_dates
-        elif isinstance(times[0], float):
+        elif np.issubdtype(times.dtype, np.floating):
             times_type = 'times'
             times_scale = ' in years'
-            continuous_maturities = np.linspace(np.min(times), np.max(times), 100)
+            continuous_maturities = np.linspace(times.min(), times.max(), 100)
             continuous_times = continuous_maturities
         else:
             raise TypeError('times can be either iterables of datetime.datetime or float numbers')
         
         plt.scatter(times, rates,
                     label='Spot Yields', marker='o', color='black', s=10)
-        plt.plot(continuous_times, self._curve(continuous_maturities),
+        plt.plot(continuous_times, self._spot_yields_core(continuous_maturities),
                  label='Nelson-Siegel-Svensson', color='gray', linestyle='-')
         
         plt.title(f'Yield Curve vs Maturity {times_type.capitalize()}')
@@ -68,23 +243,21 @@ class YieldCurve:
         plt.show()
         
         
-    def get_forward_yields(self, dates, plot=False):
+    def get_forward_yields(self, dates, plot=False, return_ndarray=False):
         """ Gets forward yields """
-        maturities = timeutils.time_difference_from_list(dates, self._today, 'years')
-        rates = self._curve(maturities)
-        rates = np.divide(rates, 10000)
-        interests = np.power(np.add(1, rates), maturities)
-        interests_shifted = np.concatenate(([1], np.roll(interests, shift=1)[1:]))
-        forwards = np.multiply(np.add(np.divide(interests, interests_shifted), -1), 10000)
+        maturities, yields = self._curve_values(dates)
+        forwards = _forward_yields(yields, maturities)
         
         if plot:
             self._plot_forward_yields(dates, forwards)
             
-        return pd.DataFrame({"date": dates, "rate": forwards})
+        return _yields_table(dates, forwards, return_ndarray)
     
     
     def _plot_forward_yields(self, dates, rates):
         """ Plots forward yields """
+        # Matplotlib is only imported when plotting
+        import matplotlib.pyplot as plt
         plt.scatter(dates, rates, label='Forward Yields',
                     marker='o', color='black', s=10)
         plt.plot(dates, rates, color='gray', linestyle='-')
@@ -95,28 +268,69 @@ class YieldCurve:
         plt.show()
         
         
-    def get_floating_yields(self, repayment_dates, repricing_dates, plot=False):
+    def get_floating_yields(self, repayment_dates, repricing_dates, plot=False, return_ndarray=False):
         """ 
         Gets variable (floating) yields for assets (loans)
         on repayment_dates when repriced on repricing dates
         """
-        repayment_dates_df = pd.DataFrame({'date': repayment_dates})
-        forward_yields_og = self.get_forward_yields(repricing_dates, plot=False)
-        forward_yields = pd.merge(repayment_dates_df, forward_yields_og, on='date', how='outer')
-        spot_yields = self.get_spot_yields(repricing_dates, plot=False)
-        forward_yields.at[0,'rate'] = spot_yields.at[0,'rate']
-        forward_yields = forward_yields.sort_values(by='date')
-        forward_yields['rate'].fillna(method='ffill', inplace=True)
-        forward_yields = forward_yields[forward_yields['date'].isin(repayment_dates)]
+        repayment_dates = _sorted_dates(repayment_dates)
+        repricing_dates = _sorted_dates(repricing_dates)
+        # THE ASSET IS A BATCH OF ONE
+        rates = self.get_floating_yields_batched(repayment_dates, repricing_dates,
+                                                 repayment_offsets=[0, len(repayment_dates)],
+                                                 repricing_offsets=[0, len(repricing_dates)])
         
         if plot:
-            self._plot_floating_yields(forward_yields['date'], forward_yields['rate'])
-    
-        return forward_yields
-    
+            self._plot_floating_yields(repayment_dates, rates)
     
+        return _yields_table(repayment_dates, rates, return_ndarray)
+
+
+    def get_floating_yields_batched(self, repayment_dates, repricing_dates,
+                                    repayment_offsets, repricing_offsets):
+        """
+        Gets floating yields for several assets at once, evaluating the curve only once.
+        The dates of all assets are concatenated: asset i owns the dates between
+        offsets[i] and offsets[i+1] of each array. The dates of each asset have to be sorted
+        and every asset needs at least one repricing date.
+        Returns the yields on all repayment dates, the same as get_floating_yields per asset
+        """
+        repayment_dates = np.asarray(repayment_dates, dtype='datetime64[D]')
+        repricing_dates = np.asarray(repricing_dates, dtype='datetime64[D]')
+        repayment_offsets = np.asarray(repayment_offsets)
+        repricing_starts = np.asarray(repricing_offsets)[:-1]
+        n_assets = len(repricing_starts)
+        # EVALUATE THE CURVE ON THE REPRICING DATES OF ALL ASSETS
+        maturities = self._maturities(repricing_dates)
+        spots = _nss(maturities, *self._params)
+        # FORWARD YIELDS BETWEEN CONSECUTIVE REPRICING DATES OF EACH ASSET
+        forwards = _forward_yields(spots, maturities, starts=repricing_starts)
+
+        # FIND THE LAST REPRICING DATE OF THE SAME ASSET ON OR BEFORE EACH REPAYMENT DATE,
+        # SEARCHING ON (ASSET, DAY) KEYS THAT ARE SORTED ACROSS ALL ASSETS
+        asset = np.repeat(np.arange(n_assets), np.diff(repayment_offsets))
+        repricing_asset = np.repeat(np.arange(n_assets), np.diff(repricing_offsets))
+        repayment_days = repayment_dates.astype(np.int64)
+        repricing_days = repricing_dates.astype(np.int64)
+        first_day = min(repayment_days.min(initial=0), repricing_days.min(initial=0))
+        span = max(repayment_days.max(initial=0), repricing_days.max(initial=0)) - first_day + 1
+        idx = np.searchsorted(repricing_asset * span + (repricing_days - first_day),
+                              asset * span + (repayment_days - first_day), side='right') - 1
+        found = idx >= 0
+        idx = np.maximum(idx, 0)
+        found &= repricing_asset[idx] == asset
+        
+        # THE FIRST REPAYMENT DATE TAKES THE SPOT YIELD OF THE FIRST REPRICING DATE,
+        # THE NEXT ONES THE FORWARD YIELD OF ANY LATER REPRICING DATE BEFORE THEM
+        first_repayment_days = repayment_days[repayment_offsets[asset]]
+        repriced = found & (repricing_days[idx] > first_repayment_days)
+        return np.where(repriced, forwards[idx], spots[repricing_starts[asset]])
+
+
     def _plot_floating_yields(self, dates, rates):
         """ Plots floating yields """
+        # Matplotlib is only imported when plotting
+        import matplotlib.pyplot as plt
         plt.scatter(dates, rates, label='Floating Yields',
                     marker='o', color='black', s=10)
         plt.plot(dates, rates, color='gray', linestyle='-')